@@ -1,31 +1,86 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, Response, stream_with_context
 from flask_cors import CORS
+import gzip
+import hmac
 import os
+import sys
 from dotenv import load_dotenv
 import google.generativeai as genai
 import logging
 import time
 import json
-from datetime import datetime
 import re
-from typing import Dict, List, Optional
 import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import lru_cache
 
+from semantic_cache import SemanticCache
+from session_store import SessionStore
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from rapidfuzz import fuzz, process as fuzz_process
+except ImportError:
+    fuzz = fuzz_process = None
+
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
 # Load environment variables
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # shared secret for /admin routes
+
+# Configure the SDK and build the model once at import; per-request
+# construction repeats SDK setup on the hot path. Gated on the key so the
+# server still starts without one (Gemini calls then fail to the fallback).
+PROMPT_PREFIX = (
+    "You are a helpful assistant for answering queries about Modern College Pune "
+    "(https://moderncollegepune.edu.in/). Respond clearly and briefly (1-2 sentences): "
+)
+# Transport is pinned explicitly so connection reuse is a guarantee, not an
+# SDK default. rest pools keep-alive connections via google-api-core's
+# session and — unlike grpc's C core — cooperates with the gevent workers
+# the README deploys under; a blocking grpc call would never yield to the
+# event loop and would serialize the whole worker unless
+# grpc.experimental.gevent.init_gevent() were wired in. GEMINI_TRANSPORT=grpc
+# remains available for threaded (non-gevent) deployments, where its single
+# multiplexed HTTP/2 channel avoids per-request handshakes.
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "rest")
+GEMINI_MODEL = None
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY, transport=GEMINI_TRANSPORT)
+    GEMINI_MODEL = genai.GenerativeModel("gemini-2.0-flash")
 
 app = Flask(__name__)
 CORS(app)
+if Compress is not None:
+    # Compresses dynamic JSON (Gemini answers); preset hits below ship
+    # pre-gzipped bytes, which flask-compress leaves alone.
+    Compress(app)
 
 # Enhanced logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Chat session storage (in production, use Redis or database)
-chat_sessions = {}
-session_lock = threading.Lock()
+# Chat session storage: Redis-backed (set REDIS_URL), in-process for dev.
+sessions = SessionStore()
+
+# Semantic cache for Gemini responses: near-duplicate questions are served
+# locally instead of paying the API round-trip.
+semantic_cache = SemanticCache()
 
 # Enhanced preset Q&A with more comprehensive responses
 PRESET_QA = {
@@ -87,52 +142,279 @@ PRESET_QA = {
 }
 }
 
-def classify_role(message: str) -> str:
-    """Basic keyword-based role classifier."""
-    msg = message.lower()
-    if any(word in msg for word in ["admission", "exam", "student login", "course", "library", "timetable"]):
-        return "student"
-    elif any(word in msg for word in ["faculty", "teacher", "staff login", "circular", "announcement", "fdp"]):
-        return "teacher"
-    elif any(word in msg for word in ["parent", "track student", "performance", "contact faculty", "hostel"]):
-        return "parent"
-    else:
+# Flattened (role, normalized question) -> answer index so preset lookup is a
+# single dict probe instead of two nested .get() calls per request.
+# Keys are interned so a hit's hash/equality check is a pointer compare
+# against the interned incoming message.
+PRESET_INDEX = {
+    (sys.intern(role), sys.intern(question)): answer
+    for role, qa in PRESET_QA.items()
+    for question, answer in qa.items()
+}
+
+# Question lengths, for rejecting messages that cannot match any preset
+# without probing the dict at all.
+PRESET_LENS = frozenset(len(question) for _, question in PRESET_INDEX)
+
+# Fuzzy fallback (rapidfuzz): near-miss phrasings like "how do i apply for
+# admission" map onto the closest preset question instead of costing a
+# Gemini call. Scored with plain fuzz.ratio, not WRatio: WRatio's scaled
+# partial-ratio band (85.5) matches any short query sharing a prefix with a
+# long key, serving wrong presets to unrelated questions. Full Levenshtein
+# ratio at cutoff 85 keeps intended near-misses (~91+) and rejects those
+# false positives (~80 and below).
+FUZZY_PRESET_CUTOFF = 85
+PRESET_KEYS_BY_ROLE = {role: list(qa) for role, qa in PRESET_QA.items()}
+
+# JSON via orjson when available (~2-5x faster dumps/loads), stdlib otherwise.
+_dumps = orjson.dumps if orjson is not None else (lambda obj: json.dumps(obj).encode())
+_loads = orjson.loads if orjson is not None else json.loads
+
+def ojson(payload, status=200):
+    """Serialize a response dict with the fast JSON encoder."""
+    return Response(_dumps(payload), status=status, mimetype='application/json')
+
+# Preset payloads serialized to JSON bytes once at import; hits return these
+# directly instead of re-serializing the same large dict every time.
+PRESET_RESPONSE_BYTES = {
+    (role, question): _dumps({"response": answer, "detected_role": role})
+    for (role, question), answer in PRESET_INDEX.items()
+}
+
+# Gzipped once at max level; the multi-kB markdown bodies shrink ~3-5x and
+# hits pay zero runtime compression.
+PRESET_RESPONSE_GZIP = {
+    key: gzip.compress(body, 9) for key, body in PRESET_RESPONSE_BYTES.items()
+}
+
+# Role keywords compiled into one alternation per role so classification is
+# a single C-level scan instead of a Python loop of substring probes.
+# Within each list, keywords are ordered most-common-first (admission/exam
+# queries dominate traffic) so the regex fallback's left-to-right
+# alternation and any future scan short-circuit on the hot terms.
+ROLE_KEYWORDS = {
+    "student": ["admission", "exam", "course", "library", "timetable", "student login"],
+    "teacher": ["faculty", "teacher", "circular", "announcement", "fdp", "staff login"],
+    "parent": ["parent", "hostel", "performance", "track student", "contact faculty"],
+}
+KNOWN_ROLES = frozenset(ROLE_KEYWORDS) | {"general"}
+# No \b anchors: the original `in` scans matched substrings ("exam" inside
+# "exams"/"examination"), and that recall is worth keeping.
+ROLE_PATTERNS = [
+    (role, re.compile("|".join(map(re.escape, keywords))))
+    for role, keywords in ROLE_KEYWORDS.items()
+]
+
+# With pyahocorasick installed, all role keywords go into one automaton and
+# the message is scanned exactly once, linear in its length regardless of
+# vocabulary size. The regex alternations above remain the fallback. A
+# Numba-jitted byte-level scanner was considered for this path and rejected:
+# with ~17 keywords both engines below already run in native code, and the
+# automaton stays O(len(message)) however large the vocabulary grows.
+ROLE_AUTOMATON = None
+if ahocorasick is not None:
+    ROLE_AUTOMATON = ahocorasick.Automaton()
+    for _role, _keywords in ROLE_KEYWORDS.items():
+        for _kw in _keywords:
+            ROLE_AUTOMATON.add_word(_kw, _role)
+    ROLE_AUTOMATON.make_automaton()
+
+def classify_role(msg: str) -> str:
+    """Basic keyword-based role classifier. Expects an already-lowercased message."""
+    if ROLE_AUTOMATON is not None:
+        # Collect all matched roles, then apply the table's priority order so
+        # results match the sequential regex checks below.
+        matched = {role for _, role in ROLE_AUTOMATON.iter(msg)}
+        for role in ROLE_KEYWORDS:
+            if role in matched:
+                return role
         return "general"
+    for role, pattern in ROLE_PATTERNS:
+        if pattern.search(msg):
+            return role
+    return "general"
+
+GEMINI_FALLBACK = "Sorry, I couldn't answer that at the moment. Please try again later."
+
+# Request coalescer: cache misses are queued and a worker drains up to
+# GEMINI_MAX_BATCH prompts per GEMINI_BATCH_WINDOW, dispatching the batch
+# concurrently so the window's round-trips overlap instead of serializing.
+# The batch is kept small to avoid p99 latency spikes.
+GEMINI_MAX_BATCH = 8
+GEMINI_BATCH_WINDOW = 0.010  # seconds
+GEMINI_TIMEOUT = 30  # seconds
+
+_gemini_queue = queue.Queue()
+_gemini_pool = ThreadPoolExecutor(max_workers=GEMINI_MAX_BATCH)
+
+def _generate(message: str) -> str:
+    response = GEMINI_MODEL.generate_content(PROMPT_PREFIX + message)
+    return response.text.strip()
+
+def _resolve(message: str, future: Future) -> None:
+    try:
+        future.set_result(_generate(message))
+    except Exception as exc:
+        future.set_exception(exc)
+
+def _gemini_worker() -> None:
+    while True:
+        batch = [_gemini_queue.get()]
+        deadline = time.monotonic() + GEMINI_BATCH_WINDOW
+        while len(batch) < GEMINI_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_gemini_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        for message, future in batch:
+            _gemini_pool.submit(_resolve, message, future)
+
+threading.Thread(target=_gemini_worker, daemon=True).start()
+
+# The cache wraps the raising inner function so a transient upstream
+# failure propagates instead of being memoized; lru_cache stores nothing
+# when the call raises, so the next identical query retries Gemini.
+@lru_cache(maxsize=1024)
+def _gemini_response_cached(message: str) -> str:
+    future = Future()
+    _gemini_queue.put((message, future))
+    return future.result(timeout=GEMINI_TIMEOUT)
 
 def get_gemini_response(message: str) -> str:
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        prompt = (
-            "You are a helpful assistant for answering queries about Modern College Pune "
-            "(https://moderncollegepune.edu.in/). Respond clearly and briefly (1-2 sentences): " + message
-        )
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return _gemini_response_cached(message)
     except Exception:
-        return "Sorry, I couldn't answer that at the moment. Please try again later."
+        return GEMINI_FALLBACK
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    data = request.get_json()
-    if not data or 'message' not in data:
-        return jsonify({"error": "No message provided."}), 400
+    try:
+        data = _loads(request.get_data())
+    except Exception:
+        data = None
+    if not isinstance(data, dict) or 'message' not in data:
+        return ojson({"error": "No message provided."}, status=400)
 
     message = data['message'].strip()
     role = data.get('role')  # Optional role
+    session_id = data.get('session_id')  # Optional session tracking
+
+    # Lowercase once; the classifier, preset lookup and caches all reuse it.
+    normalized = message.lower()
+
+    # A valid client-supplied role skips classification entirely; unknown
+    # values fall through to the classifier rather than missing every preset.
+    if role not in KNOWN_ROLES:
+        role = classify_role(normalized)
+    preset_key = None
+    if len(normalized) in PRESET_LENS:
+        # Bounded intern: only strings short enough to plausibly be preset
+        # questions; never intern arbitrarily long user input.
+        if len(normalized) <= 128:
+            normalized = sys.intern(normalized)
+        if (role, normalized) in PRESET_RESPONSE_BYTES:
+            preset_key = (role, normalized)
+
+    if preset_key is None and fuzz_process is not None:
+        preset_keys = PRESET_KEYS_BY_ROLE.get(role)
+        if preset_keys:
+            match = fuzz_process.extractOne(
+                normalized, preset_keys,
+                scorer=fuzz.ratio, score_cutoff=FUZZY_PRESET_CUTOFF,
+            )
+            if match is not None:
+                preset_key = (role, match[0])
+
+    if preset_key is not None:
+        if session_id:
+            sessions.append(session_id, {
+                "message": message,
+                "response": PRESET_INDEX[preset_key]["response"],
+                "role": role,
+            })
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            resp = Response(PRESET_RESPONSE_GZIP[preset_key], mimetype='application/json')
+            resp.headers['Content-Encoding'] = 'gzip'
+        else:
+            resp = Response(PRESET_RESPONSE_BYTES[preset_key], mimetype='application/json')
+        # Both variants negotiate on Accept-Encoding, so both must say so.
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
 
-    if not role:
-        role = classify_role(message)
+    response = semantic_cache.lookup(normalized)
+    if response is None:
+        # Pass the normalized form so exact repeats share an LRU slot.
+        response = get_gemini_response(normalized)
+        if response != GEMINI_FALLBACK:
+            semantic_cache.store(normalized, response)
 
+    if session_id:
+        sessions.append(session_id, {"message": message, "response": response, "role": role})
+
+    return ojson({"response": response, "detected_role": role})
+
+def _sse(payload) -> bytes:
+    """Format one server-sent event; JSON framing keeps newlines intact."""
+    return b"data: " + _dumps(payload) + b"\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /api/chat: SSE chunks as Gemini generates them.
+
+    First-token latency replaces full-generation latency on the client.
+    Preset hits arrive as a single chunk. The non-streaming endpoint stays
+    for clients that want one JSON body.
+    """
+    try:
+        data = _loads(request.get_data())
+    except Exception:
+        data = None
+    if not isinstance(data, dict) or 'message' not in data:
+        return ojson({"error": "No message provided."}, status=400)
+
+    message = data['message'].strip()
+    role = data.get('role')
     normalized = message.lower()
-    role_answers = PRESET_QA.get(role, {})
-    preset_answer = role_answers.get(normalized)
+    if role not in KNOWN_ROLES:
+        role = classify_role(normalized)
+
+    preset_answer = PRESET_INDEX.get((role, normalized))
+
+    def generate():
+        yield _sse({"detected_role": role})
+        if preset_answer is not None:
+            yield _sse({"text": preset_answer["response"]})
+        else:
+            try:
+                stream = GEMINI_MODEL.generate_content(
+                    PROMPT_PREFIX + message, stream=True)
+                for chunk in stream:
+                    if chunk.text:
+                        yield _sse({"text": chunk.text})
+            except Exception:
+                yield _sse({"text": GEMINI_FALLBACK})
+        yield b"data: [DONE]\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
-    if preset_answer:
-        response = preset_answer
-    else:
-        response = get_gemini_response(message)
+@app.route('/admin/flush', methods=['POST'])
+def flush_cache():
+    """Clear the exact-match Gemini cache (staleness control).
 
-    return jsonify({"response": response, "detected_role": role})
+    Requires the ADMIN_TOKEN shared secret in X-Admin-Token; the route is
+    disabled when no token is configured, since the app is CORS-open and an
+    unauthenticated flush would let any origin force traffic onto Gemini.
+    """
+    supplied = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(supplied, ADMIN_TOKEN):
+        return ojson({"error": "Forbidden."}, status=403)
+    _gemini_response_cached.cache_clear()
+    return ojson({"status": "flushed"})
 
 if __name__ == '__main__':
+    # Dev server only — single-threaded, serializes all Gemini I/O. In
+    # production run under gunicorn with gevent workers (see README).
     app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""Semantic response cache backed by sqlite + sqlite-vec.
+
+Embeds each incoming message with a small local sentence-transformer and
+looks up the nearest previously-answered message by cosine distance. On a
+close-enough hit the stored response is returned without a Gemini call.
+
+The vector extension and embedding model are optional; when either is
+missing the cache silently disables itself and every lookup is a miss.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import sqlite_vec
+    from sentence_transformers import SentenceTransformer
+    _DEPS_AVAILABLE = True
+except ImportError:
+    _DEPS_AVAILABLE = False
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+# How long a request waits for the background model load before treating
+# the cache as a miss. Bounded so a stalled first-run download (the model
+# is fetched from HuggingFace) can't block the Gemini path forever.
+MODEL_WAIT_TIMEOUT = 5.0  # seconds
+
+
+class SemanticCache:
+    def __init__(self, db_path="semantic_cache.db", max_distance=0.15,
+                 ttl_seconds=24 * 3600, max_entries=10000):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = _DEPS_AVAILABLE
+        self._lock = threading.Lock()
+        self._model = None
+        self._model_ready = threading.Event()
+        if not self.enabled:
+            logger.info("Semantic cache disabled (sqlite-vec / sentence-transformers not installed)")
+            return
+        # Short timeout: under multi-process gunicorn several workers share
+        # this file, and sqlite's default 5s busy wait is a blocking C call
+        # that would stall a gevent worker's whole event loop. A contended
+        # write fails fast instead and is swallowed as a miss below.
+        self._db = sqlite3.connect(db_path, timeout=0.25, check_same_thread=False)
+        self._db.enable_load_extension(True)
+        sqlite_vec.load(self._db)
+        self._db.enable_load_extension(False)
+        # WAL lets readers proceed while another process commits.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "id INTEGER PRIMARY KEY, message TEXT, response TEXT, created REAL)"
+        )
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS cache_vectors USING vec0("
+            f"embedding float[{EMBEDDING_DIM}] distance_metric=cosine)"
+        )
+        self._db.commit()
+        # Load the model off the import path so startup (and the first
+        # request) doesn't pay the multi-second load; requests arriving
+        # before it finishes block briefly on the ready event.
+        threading.Thread(target=self._load_model, daemon=True).start()
+
+    def _load_model(self) -> None:
+        try:
+            model = SentenceTransformer(EMBEDDING_MODEL)
+            model.encode("warmup", normalize_embeddings=True)
+            self._model = model
+            logger.info("Embedding model loaded and warmed")
+        except Exception:
+            logger.exception("Embedding model failed to load; semantic cache disabled")
+            self.enabled = False
+        finally:
+            self._model_ready.set()
+
+    def _embed(self, message: str) -> bytes:
+        vector = self._model.encode(message, normalize_embeddings=True)
+        return sqlite_vec.serialize_float32(vector.tolist())
+
+    def lookup(self, message: str):
+        """Return the cached response for the nearest stored message, or None."""
+        if not self.enabled:
+            return None
+        if not self._model_ready.wait(timeout=MODEL_WAIT_TIMEOUT):
+            return None
+        if self._model is None:
+            return None
+        try:
+            embedding = self._embed(message)
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT e.response, e.created, v.distance "
+                    "FROM cache_vectors v JOIN cache_entries e ON e.id = v.rowid "
+                    "WHERE v.embedding MATCH ? AND k = 1",
+                    (embedding,),
+                ).fetchone()
+        except Exception:
+            # Cache trouble must never fail the request; treat as a miss.
+            logger.exception("Semantic cache lookup failed")
+            return None
+        if row is None:
+            return None
+        response, created, distance = row
+        if distance > self.max_distance or time.time() - created > self.ttl_seconds:
+            return None
+        logger.info("Semantic cache hit (distance=%.3f)", distance)
+        return response
+
+    def store(self, message: str, response: str) -> None:
+        if not self.enabled:
+            return
+        if not self._model_ready.wait(timeout=MODEL_WAIT_TIMEOUT):
+            return
+        if self._model is None:
+            return
+        try:
+            embedding = self._embed(message)
+            now = time.time()
+            with self._lock:
+                cursor = self._db.execute(
+                    "INSERT INTO cache_entries (message, response, created) VALUES (?, ?, ?)",
+                    (message, response, now),
+                )
+                self._db.execute(
+                    "INSERT INTO cache_vectors (rowid, embedding) VALUES (?, ?)",
+                    (cursor.lastrowid, embedding),
+                )
+                self._evict(now)
+                self._db.commit()
+        except Exception:
+            # Dropping the entry is fine; the response was already served.
+            logger.exception("Semantic cache store failed")
+            try:
+                self._db.rollback()
+            except Exception:
+                pass
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the oldest entries beyond the size cap."""
+        self._db.execute(
+            "DELETE FROM cache_vectors WHERE rowid IN "
+            "(SELECT id FROM cache_entries WHERE created < ?)",
+            (now - self.ttl_seconds,),
+        )
+        self._db.execute("DELETE FROM cache_entries WHERE created < ?",
+                         (now - self.ttl_seconds,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM cache_vectors WHERE rowid IN "
+                "(SELECT id FROM cache_entries ORDER BY created LIMIT ?)",
+                (overflow,),
+            )
+            self._db.execute(
+                "DELETE FROM cache_entries WHERE id IN "
+                "(SELECT id FROM cache_entries ORDER BY created LIMIT ?)",
+                (overflow,),
+            )
@@ -0,0 +1,63 @@
+"""Chat session storage.
+
+Backed by Redis with one key per session and a sliding TTL, which keeps the
+server stateless: any gunicorn worker (or any host) can serve any session,
+and there is no process-wide lock for readers to contend on. When Redis (or
+the client library) is absent the store falls back to an in-process dict so
+development still works single-process.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_dumps = orjson.dumps if orjson is not None else (lambda obj: json.dumps(obj).encode())
+_loads = orjson.loads if orjson is not None else json.loads
+
+SESSION_TTL = 3600  # seconds
+MAX_TURNS = 20  # exchanges kept per session
+
+
+class SessionStore:
+    def __init__(self, url=None, ttl_seconds=SESSION_TTL):
+        self.ttl_seconds = ttl_seconds
+        url = url or os.getenv("REDIS_URL")
+        self._redis = None
+        if redis is not None and url:
+            self._redis = redis.Redis.from_url(url)
+        else:
+            logger.info("Session store using in-process fallback (no Redis)")
+        self._local = {}
+        self._local_lock = threading.Lock()
+
+    def get(self, session_id: str) -> list:
+        """Return the session's history (most recent last), empty if unknown."""
+        if self._redis is not None:
+            raw = self._redis.get(f"sess:{session_id}")
+            return _loads(raw) if raw else []
+        with self._local_lock:
+            return list(self._local.get(session_id, []))
+
+    def append(self, session_id: str, entry: dict) -> None:
+        """Append one exchange and refresh the session TTL."""
+        history = self.get(session_id)
+        history.append(entry)
+        history = history[-MAX_TURNS:]
+        if self._redis is not None:
+            self._redis.set(f"sess:{session_id}", _dumps(history), ex=self.ttl_seconds)
+        else:
+            with self._local_lock:
+                self._local[session_id] = history